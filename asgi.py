@@ -0,0 +1,267 @@
+import asyncio
+import io
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+from koox.config import ROUTING_MAX_PENDING, ROUTING_WORKERS, WSGI_WORKERS
+from koox.instructions import (
+    compute_route_instructions,
+    parse_route_query,
+    route_cache,
+    route_response,
+    shutdown_batch_pool,
+)
+from koox.metrics import http_request_duration, http_requests, serialization_bytes, serialization_duration
+from koox.responses import encode_json, negotiate_response
+from koox.store import current_dataset, start_data_watcher
+from main import app as flask_app
+
+# Punto de entrada ASGI para producción:
+#
+#   uvicorn asgi:app --host 0.0.0.0 --port 5000
+#
+# /paradas, /paradas/<id> e /instrucciones se atienden aquí sin bloquear el
+# event loop. Las búsquedas de rutas van a un pool acotado de hilos, y varias
+# consultas idénticas simultáneas esperan una sola búsqueda. El resto de los
+# endpoints se delegan a la app Flask de main.py en otro pool de hilos, así
+# que una ráfaga de búsquedas lentas no frena las consultas baratas. Ambos
+# modos usan las mismas estructuras de koox.
+
+routing_pool = ThreadPoolExecutor(max_workers=ROUTING_WORKERS, thread_name_prefix="koox-routing")
+wsgi_pool = ThreadPoolExecutor(max_workers=WSGI_WORKERS, thread_name_prefix="koox-wsgi")
+
+# Búsquedas en curso: (versión, inicio, destino) -> asyncio.Future
+inflight = {}
+
+
+class ServerBusy(Exception):
+    pass
+
+
+# ---------------------------------------------------
+#   RESPUESTAS
+# ---------------------------------------------------
+async def send_response(send, status, body, headers=(), content_type=b"application/json", data=None):
+    headers = [
+        (b"content-type", content_type),
+        (b"content-length", str(len(body)).encode()),
+        (b"access-control-allow-origin", b"*"),
+        *headers,
+    ]
+    if data is not None:
+        headers.append((b"x-dataset-version", data.version.encode()))
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def send_json(send, status, payload, data=None):
+    started = time.perf_counter()
+    body = encode_json(payload)
+    serialization_duration.observe(time.perf_counter() - started)
+    serialization_bytes.observe(len(body))
+    await send_response(send, status, body, data=data)
+
+
+async def send_prepared(send, scope, variants, data):
+    request_headers = dict(scope["headers"])
+    status, body, headers = negotiate_response(
+        variants,
+        request_headers.get(b"if-none-match", b"").decode("latin-1"),
+        request_headers.get(b"accept-encoding", b"").decode("latin-1"),
+    )
+    headers = [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers]
+    await send_response(send, status, body, headers, data=data)
+
+
+# ---------------------------------------------------
+#   BÚSQUEDA DE RUTAS (POOL + COALESCENCIA)
+# ---------------------------------------------------
+async def coalesced_route(data, start_id, end_id):
+    # Devuelve la lista de tramos o None. Lanza ServerBusy si ya hay
+    # ROUTING_MAX_PENDING búsquedas distintas esperando. Quien se une a una
+    # búsqueda en curso no consulta la caché: sólo la primera consulta cuenta
+    # como fallo en las estadísticas.
+    key = (data.version, start_id, end_id)
+    future = inflight.get(key)
+    if future is None:
+        found, instructions = route_cache.get(key)
+        if found:
+            return instructions
+        if len(inflight) >= ROUTING_MAX_PENDING:
+            raise ServerBusy()
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(routing_pool, compute_route_instructions, data, start_id, end_id)
+        inflight[key] = future
+        future.add_done_callback(lambda _: inflight.pop(key, None))
+
+    # shield: si un cliente se desconecta no se cancela la búsqueda de los demás
+    return await asyncio.shield(future)
+
+
+async def get_paradas(scope, send, data):
+    await send_prepared(send, scope, data.responses["all"], data)
+
+
+async def get_parada(scope, send, data):
+    prepared = data.responses["by_id"].get(int(scope["path"][len("/paradas/"):]))
+    if not prepared:
+        return await send_json(send, 404, {"ok": False, "message": "Parada no encontrada"}, data)
+    await send_prepared(send, scope, prepared, data)
+
+
+async def instrucciones(scope, send, data):
+    args = parse_qs(scope["query_string"].decode("latin-1"))
+    status, result = parse_route_query(data, args.get("inicio", [None])[0], args.get("destino", [None])[0])
+    if status is not None:
+        return await send_json(send, status, result, data)
+
+    start, end = result
+    try:
+        instructions = await coalesced_route(data, start[0]["id"], end[0]["id"])
+    except ServerBusy:
+        return await send_json(send, 503, {"ok": False, "message": "Servidor ocupado, intenta de nuevo"}, data)
+
+    status, payload = route_response(start, end, instructions)
+    await send_json(send, status, payload, data)
+
+
+# ---------------------------------------------------
+#   PUENTE WSGI (RESTO DE ENDPOINTS)
+# ---------------------------------------------------
+def build_environ(scope, body):
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope["query_string"].decode("latin-1"),
+        "SERVER_NAME": str(server[0]),
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": str(client[0]),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope["headers"]:
+        name = name.decode("latin-1").upper().replace("-", "_")
+        value = value.decode("latin-1")
+        if name == "CONTENT_TYPE" or name == "CONTENT_LENGTH":
+            environ[name] = value
+            continue
+        key = f"HTTP_{name}"
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+
+    # El cuerpo ya se leyó completo: su largo vale aunque el cliente lo haya
+    # enviado por partes (sin Content-Length, Transfer-Encoding: chunked)
+    environ["CONTENT_LENGTH"] = str(len(body))
+    environ["wsgi.input_terminated"] = True
+    return environ
+
+
+def run_wsgi(environ):
+    response = {}
+    chunks = []
+
+    def start_response(status, headers, exc_info=None):
+        response["status"] = int(status.split(" ", 1)[0])
+        response["headers"] = headers
+        return chunks.append
+
+    result = flask_app(environ, start_response)
+    try:
+        chunks.extend(result)
+    finally:
+        if hasattr(result, "close"):
+            result.close()
+    return response["status"], response["headers"], b"".join(chunks)
+
+
+async def call_wsgi(scope, receive, send):
+    body = b""
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+    loop = asyncio.get_running_loop()
+    status, headers, content = await loop.run_in_executor(wsgi_pool, run_wsgi, build_environ(scope, body))
+
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in headers],
+    })
+    await send({"type": "http.response.body", "body": content})
+
+
+# ---------------------------------------------------
+#   APP ASGI
+# ---------------------------------------------------
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            start_data_watcher()
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            routing_pool.shutdown(wait=False)
+            wsgi_pool.shutdown(wait=False)
+            shutdown_batch_pool()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+def native_route(scope):
+    # Devuelve (endpoint, handler) si la consulta se atiende aquí, o
+    # (None, None) para delegarla a Flask. Las consultas perfiladas
+    # (?profile=1 / X-Profile: 1) siempre van a Flask.
+    if scope["method"] != "GET":
+        return None, None
+    if parse_qs(scope["query_string"].decode("latin-1")).get("profile") == ["1"]:
+        return None, None
+    if dict(scope["headers"]).get(b"x-profile") == b"1":
+        return None, None
+
+    path = scope["path"]
+    if path == "/paradas":
+        return "/paradas", get_paradas
+    if path.startswith("/paradas/") and path[len("/paradas/"):].isascii() and path[len("/paradas/"):].isdigit():
+        return "/paradas/<int:id>", get_parada
+    if path == "/instrucciones":
+        return "/instrucciones", instrucciones
+    return None, None
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+    if scope["type"] != "http":
+        return
+
+    start_data_watcher()
+
+    endpoint, handler = native_route(scope)
+    if handler is None:
+        return await call_wsgi(scope, receive, send)
+
+    # Mismas métricas que los endpoints de Flask (mismo nombre de endpoint)
+    started = time.perf_counter()
+    status = []
+
+    async def send_tracked(message):
+        if message["type"] == "http.response.start":
+            status.append(message["status"])
+        await send(message)
+
+    await handler(scope, send_tracked, current_dataset())
+    http_request_duration.observe(time.perf_counter() - started, endpoint, "GET")
+    http_requests.inc(endpoint, "GET", str(status[0] if status else 500))
@@ -0,0 +1,353 @@
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime
+from urllib.parse import quote, urlencode
+
+# Los datos sintéticos se instalan a mano en koox.store; la recarga en caliente
+# los reemplazaría por el archivo real a los pocos segundos.
+os.environ["DATA_WATCH_INTERVAL"] = "0"
+
+from koox import store  # noqa: E402
+from koox.dataset import build_dataset, load_data  # noqa: E402
+from koox.geo import closest_stop, nearest_stops  # noqa: E402
+from koox.instructions import route_cache  # noqa: E402
+from koox.responses import bus_responses  # noqa: E402
+from koox.routing import find_route, find_routes_from  # noqa: E402
+from koox.search import search_ngram_index  # noqa: E402
+from main import app  # noqa: E402
+
+# Benchmarks de funciones internas y de endpoints:
+#
+#   python benchmark.py --scales 1,10,100 --output bench.json
+#   python benchmark.py --compare antes.json despues.json
+#
+# Los resultados se escriben en JSON (stdout o --output) para compararlos
+# entre commits; el resumen legible sale por stderr.
+
+# Zona de Campeche donde se generan coordenadas aleatorias
+CAMPECHE_BBOX = {
+    "min_lat": 19.76,
+    "max_lat": 19.87,
+    "min_lon": -90.62,
+    "max_lon": -90.47,
+}
+
+# Desplazamiento máximo (grados, ~300 m) de las copias sintéticas de cada parada
+SYNTHETIC_JITTER = 0.003
+
+# Fracción de paradas de cada copia que también pertenece a las rutas de la
+# copia anterior, para que las copias queden conectadas entre sí
+SYNTHETIC_LINK_RATE = 0.05
+
+
+# ---------------------------------------------------
+#   DATOS SINTÉTICOS
+# ---------------------------------------------------
+def scale_stops(stops, factor, seed):
+    # Copia factor veces las paradas, desplazadas un poco, con rutas propias
+    # por copia ("<ruta> #2", "<ruta> #3", ...). La copia 1 son los datos reales.
+    rng = random.Random(seed)
+    id_step = max((s["id"] for s in stops), default=0) + 1
+
+    def route_name(route, copy):
+        return route if copy == 0 else f"{route} #{copy + 1}"
+
+    scaled = []
+    for copy in range(factor):
+        for stop in stops:
+            if copy == 0:
+                scaled.append(stop)
+                continue
+
+            routes = [route_name(r, copy) for r in stop.get("routes", [])]
+            if rng.random() < SYNTHETIC_LINK_RATE:
+                routes += [route_name(r, copy - 1) for r in stop.get("routes", [])]
+
+            scaled.append({
+                "id": stop["id"] + copy * id_step,
+                "stop_name": f"{stop['stop_name']} {copy + 1}",
+                "latitude": round(stop["latitude"] + rng.uniform(-SYNTHETIC_JITTER, SYNTHETIC_JITTER), 6),
+                "longitude": round(stop["longitude"] + rng.uniform(-SYNTHETIC_JITTER, SYNTHETIC_JITTER), 6),
+                "routes": routes,
+            })
+    return scaled
+
+
+def random_point(rng):
+    return (
+        rng.uniform(CAMPECHE_BBOX["min_lat"], CAMPECHE_BBOX["max_lat"]),
+        rng.uniform(CAMPECHE_BBOX["min_lon"], CAMPECHE_BBOX["max_lon"]),
+    )
+
+
+# ---------------------------------------------------
+#   ESTADÍSTICAS
+# ---------------------------------------------------
+def percentile(sorted_values, p):
+    # Percentil por rango más cercano sobre valores ya ordenados
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(p / 100 * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(samples_ns, wall_ns=None):
+    samples = sorted(samples_ns)
+    total = wall_ns if wall_ns is not None else sum(samples)
+    ms = 1e-6
+    return {
+        "count": len(samples),
+        "ops_per_s": round(len(samples) / (total / 1e9), 2) if total else 0.0,
+        "mean_ms": round(sum(samples) / len(samples) * ms, 4) if samples else 0.0,
+        "p50_ms": round(percentile(samples, 50) * ms, 4),
+        "p90_ms": round(percentile(samples, 90) * ms, 4),
+        "p99_ms": round(percentile(samples, 99) * ms, 4),
+        "max_ms": round(samples[-1] * ms, 4) if samples else 0.0,
+    }
+
+
+def time_calls(fn, args_list):
+    samples = []
+    perf = time.perf_counter_ns
+    for args in args_list:
+        start = perf()
+        fn(*args)
+        samples.append(perf() - start)
+    return samples
+
+
+# ---------------------------------------------------
+#   MICROBENCHMARKS
+# ---------------------------------------------------
+def run_micro(data, rng, options):
+    results = {}
+    ids = [s["id"] for s in data.stops]
+    points = [random_point(rng) for _ in range(options.samples)]
+
+    results["closest_stop"] = summarize(time_calls(
+        lambda lat, lon: closest_stop(data, lat, lon), points))
+    results["nearest_stops_k5"] = summarize(time_calls(
+        lambda lat, lon: nearest_stops(data, lat, lon, k=5), points))
+    results["nearest_stops_radius_1km"] = summarize(time_calls(
+        lambda lat, lon: nearest_stops(data, lat, lon, radius_km=1.0), points))
+
+    # find_route: todos los pares con --all-pairs, si no una muestra aleatoria
+    if options.all_pairs:
+        pairs = [(s, e) for s in ids for e in ids]
+    else:
+        pairs = [(rng.choice(ids), rng.choice(ids)) for _ in range(options.pairs)]
+    found = 0
+
+    def route(start_id, end_id):
+        nonlocal found
+        if find_route(data, start_id, end_id) is not None:
+            found += 1
+
+    results["find_route"] = summarize(time_calls(route, pairs))
+    results["find_route"]["found"] = found
+
+    # find_routes_from: de cada origen a todas las paradas (lo que usa el lote)
+    origins = ids if options.all_pairs else rng.sample(ids, min(options.origins, len(ids)))
+    results["find_routes_from_all"] = summarize(time_calls(
+        lambda start_id: find_routes_from(data, start_id, ids), [(s,) for s in origins]))
+
+    queries = []
+    for _ in range(options.samples):
+        name = rng.choice(data.stops)["stop_name"]
+        start = rng.randrange(max(1, len(name) - 3))
+        queries.append((name[start:start + rng.choice((2, 3, 5, 8))],))
+    results["search_stops"] = summarize(time_calls(
+        lambda q: search_ngram_index(data.search["stops"], q), queries))
+
+    return results
+
+
+# ---------------------------------------------------
+#   ENDPOINTS (CLIENTE DE PRUEBA DE FLASK)
+# ---------------------------------------------------
+def endpoint_requests(data, rng):
+    # Cada endpoint genera (método, url, cuerpo JSON) para una consulta aleatoria
+    ids = [s["id"] for s in data.stops]
+    routes = list(data.route_to_stops)
+
+    def coords():
+        return "%.6f,%.6f" % random_point(rng)
+
+    def near(**extra):
+        latitude, longitude = random_point(rng)
+        return urlencode(dict(latitude=latitude, longitude=longitude, **extra))
+
+    def search_query():
+        name = rng.choice(data.stops)["stop_name"]
+        return urlencode({"q": name[:rng.choice((3, 5, 8))]})
+
+    def batch_body():
+        return {
+            "origins": [list(random_point(rng)) for _ in range(5)],
+            "destinations": [list(random_point(rng)) for _ in range(5)],
+            "format": "matrix",
+        }
+
+    return {
+        "GET /paradas": lambda: ("GET", "/paradas", None),
+        "GET /paradas/<id>": lambda: ("GET", f"/paradas/{rng.choice(ids)}", None),
+        "GET /paradas/bus/<name>": lambda: ("GET", f"/paradas/bus/{quote(rng.choice(routes), safe='')}", None),
+        "GET /paradas/buscar": lambda: ("GET", f"/paradas/buscar?{search_query()}", None),
+        "GET /rutas": lambda: ("GET", "/rutas", None),
+        "GET /paradas/cercana": lambda: ("GET", f"/paradas/cercana?{near()}", None),
+        "GET /paradas/cercanas": lambda: ("GET", f"/paradas/cercanas?{near(k=5)}", None),
+        "GET /instrucciones": lambda: ("GET", f"/instrucciones?{urlencode({'inicio': coords(), 'destino': coords()})}", None),
+        "POST /instrucciones/batch": lambda: ("POST", "/instrucciones/batch", batch_body()),
+    }
+
+
+def run_http(data, rng, options):
+    results = {}
+    client = app.test_client()
+    perf = time.perf_counter_ns
+
+    for name, make_request in endpoint_requests(data, rng).items():
+        route_cache.clear()
+        bus_responses.clear()
+
+        requests = [make_request() for _ in range(options.requests)]
+        samples = []
+        errors = 0
+        wall_start = perf()
+        for method, url, body in requests:
+            start = perf()
+            response = client.open(url, method=method, json=body)
+            response.get_data()
+            samples.append(perf() - start)
+            if response.status_code >= 500 or response.status_code == 400:
+                errors += 1
+        stats = summarize(samples, perf() - wall_start)
+        stats["errors"] = errors
+        results[name] = stats
+
+    return results
+
+
+# ---------------------------------------------------
+#   COMPARACIÓN ENTRE RESULTADOS
+# ---------------------------------------------------
+def compare(old_path, new_path):
+    with open(old_path, encoding="utf-8") as f:
+        old = json.load(f)
+    with open(new_path, encoding="utf-8") as f:
+        new = json.load(f)
+
+    old_scales = {s["scale"]: s for s in old["scales"]}
+    print(f"{'escala':>6}  {'benchmark':<36} {'p50 antes':>11} {'p50 ahora':>11} {'cambio':>8}")
+    for scale in new["scales"]:
+        before = old_scales.get(scale["scale"])
+        if before is None:
+            continue
+        for section in ("micro", "http"):
+            for name, stats in scale.get(section, {}).items():
+                previous = before.get(section, {}).get(name)
+                if previous is None:
+                    continue
+                change = (stats["p50_ms"] / previous["p50_ms"] - 1) * 100 if previous["p50_ms"] else 0.0
+                print(f"{scale['scale']:>5}x  {name:<36} {previous['p50_ms']:>9.4f}ms {stats['p50_ms']:>9.4f}ms {change:>+7.1f}%")
+
+
+# ---------------------------------------------------
+#   EJECUCIÓN
+# ---------------------------------------------------
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def log(message):
+    print(message, file=sys.stderr, flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks de la API de paradas Koox")
+    parser.add_argument("--scales", default="1,10", help="factores de escala separados por comas (p. ej. 1,10,100)")
+    parser.add_argument("--samples", type=int, default=2000, help="coordenadas aleatorias por microbenchmark")
+    parser.add_argument("--pairs", type=int, default=1000, help="pares aleatorios para find_route")
+    parser.add_argument("--origins", type=int, default=10, help="orígenes para find_routes_from")
+    parser.add_argument("--all-pairs", action="store_true", help="usar todos los pares de paradas (lento)")
+    parser.add_argument("--requests", type=int, default=200, help="consultas por endpoint")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--skip-micro", action="store_true")
+    parser.add_argument("--skip-http", action="store_true")
+    parser.add_argument("--output", help="archivo JSON de salida (por defecto stdout)")
+    parser.add_argument("--compare", nargs=2, metavar=("ANTES", "DESPUES"), help="comparar dos resultados")
+    options = parser.parse_args()
+
+    if options.compare:
+        compare(*options.compare)
+        return
+
+    try:
+        scales = [int(s) for s in options.scales.split(",")]
+        if any(s < 1 for s in scales):
+            raise ValueError
+    except ValueError:
+        parser.error("--scales debe ser una lista de enteros positivos")
+
+    base_stops, base_version = load_data()
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "date": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "data_version": base_version,
+            "seed": options.seed,
+            "options": {k: v for k, v in vars(options).items() if k not in ("output", "compare")},
+        },
+        "scales": [],
+    }
+
+    for scale in scales:
+        rng = random.Random(options.seed)
+        stops = scale_stops(base_stops, scale, options.seed)
+
+        start = time.perf_counter()
+        data = build_dataset(stops, f"{base_version}-x{scale}")
+        build_s = time.perf_counter() - start
+        store.dataset = data
+        log(f"[{scale}x] {len(data.stops)} paradas, {len(data.route_to_stops)} rutas, construido en {build_s:.2f}s")
+
+        result = {
+            "scale": scale,
+            "stops": len(data.stops),
+            "routes": len(data.route_to_stops),
+            "build_s": round(build_s, 4),
+        }
+        if not options.skip_micro:
+            result["micro"] = run_micro(data, rng, options)
+        if not options.skip_http:
+            result["http"] = run_http(data, rng, options)
+
+        for section in ("micro", "http"):
+            for name, stats in result.get(section, {}).items():
+                log(f"[{scale}x] {name:<34} p50 {stats['p50_ms']:>9.4f}ms  p99 {stats['p99_ms']:>9.4f}ms  {stats['ops_per_s']:>10.1f}/s")
+        report["scales"].append(result)
+
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if options.output:
+        with open(options.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
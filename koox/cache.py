@@ -0,0 +1,57 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+# ---------------------------------------------------
+#   CACHÉ LRU
+# ---------------------------------------------------
+# Caché acotada con expiración opcional (ttl en segundos; 0 = sin expiración)
+# y contadores de aciertos/fallos. Segura entre hilos.
+class LRUCache:
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                value, expires = entry
+                if expires is None or expires > time.monotonic():
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return True, value
+                del self.entries[key]
+            self.misses += 1
+            return False, None
+
+    def put(self, key, value):
+        if self.max_size <= 0:
+            return
+        expires = time.monotonic() + self.ttl if self.ttl > 0 else None
+        with self.lock:
+            self.entries[key] = (value, expires)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self.entries),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+            }
@@ -0,0 +1,45 @@
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Archivo JSON
+JSON_FILE = 'db/koox_stops_routes.json'
+
+# Caché de instrucciones (tamaño máximo y segundos de vida; 0 = sin expiración)
+ROUTE_CACHE_SIZE = int(os.getenv("ROUTE_CACHE_SIZE", "1024"))
+ROUTE_CACHE_TTL = float(os.getenv("ROUTE_CACHE_TTL", "3600"))
+
+# Límites de /instrucciones/batch: pares por consulta con format=matrix y con
+# format=instructions (cada par son ~1.2 KB de JSON), y procesos del pool
+# compartido para repartir los orígenes (0 = buscar en el hilo de la consulta)
+BATCH_MAX_PAIRS = int(os.getenv("BATCH_MAX_PAIRS", "250000"))
+BATCH_MAX_INSTRUCTION_PAIRS = int(os.getenv("BATCH_MAX_INSTRUCTION_PAIRS", "500"))
+BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", "0"))
+
+# Paginación de /paradas/buscar y /rutas
+SEARCH_PER_PAGE = 20
+SEARCH_MAX_PER_PAGE = 100
+
+# Máximo de paradas por consulta de /paradas/cercanas (k, o las más cercanas
+# dentro de radius_km si no se envía k)
+NEAREST_MAX_K = 100
+
+# Respuestas de /paradas/bus/<name> ya codificadas que se guardan en memoria
+BUS_RESPONSE_CACHE_SIZE = int(os.getenv("BUS_RESPONSE_CACHE_SIZE", "256"))
+
+# Recarga en caliente: cada cuántos segundos se revisa el archivo JSON
+# (0 = nunca) y token para POST /admin/recargar (sin token queda deshabilitado)
+DATA_WATCH_INTERVAL = float(os.getenv("DATA_WATCH_INTERVAL", "5"))
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+# Modo ASGI (asgi.py): hilos para las búsquedas de rutas, cuántas búsquedas
+# pueden esperar turno antes de responder 503, e hilos para el resto de
+# endpoints que se atienden con la app Flask
+ROUTING_WORKERS = int(os.getenv("ROUTING_WORKERS", "4"))
+ROUTING_MAX_PENDING = int(os.getenv("ROUTING_MAX_PENDING", "256"))
+WSGI_WORKERS = int(os.getenv("WSGI_WORKERS", "8"))
+
+# Perfilado por consulta (?profile=1 o X-Profile: 1, requiere ADMIN_TOKEN):
+# cuántas funciones se muestran en el resumen de cProfile
+PROFILE_TOP = int(os.getenv("PROFILE_TOP", "40"))
@@ -0,0 +1,83 @@
+import hashlib
+import json
+from collections import defaultdict, namedtuple
+from datetime import datetime
+
+from koox.config import JSON_FILE
+from koox.geo import build_columns, build_kdtree
+from koox.responses import build_prepared_responses
+from koox.routing import build_routing_engine
+from koox.search import build_search_index
+
+
+# Función para cargar datos. Devuelve (paradas, versión), donde la versión es
+# un hash del contenido del archivo.
+def load_data():
+    try:
+        with open(JSON_FILE, 'rb') as f:
+            raw = f.read()
+        return json.loads(raw.decode('utf-8')), hashlib.sha256(raw).hexdigest()[:12]
+    except FileNotFoundError:
+        raise Exception(f"El archivo {JSON_FILE} no fue encontrado.")
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        raise Exception(f"Error al decodificar el archivo JSON.")
+
+
+# ---------------------------------------------------
+#   MAPAS AUXILIARES
+# ---------------------------------------------------
+def build_maps(stops):
+    stops_by_id = {s["id"]: s for s in stops}
+
+    route_to_stops = defaultdict(set)
+    stop_to_routes = defaultdict(set)
+
+    for stop in stops:
+        for r in stop.get("routes", []):
+            route_to_stops[r].add(stop["id"])
+            stop_to_routes[stop["id"]].add(r)
+
+    # Diccionarios normales con frozensets: una consulta nunca los modifica
+    route_to_stops = {r: frozenset(ids) for r, ids in route_to_stops.items()}
+    stop_to_routes = {stop_id: frozenset(routes) for stop_id, routes in stop_to_routes.items()}
+    return stops_by_id, route_to_stops, stop_to_routes
+
+
+# ---------------------------------------------------
+#   VERSIÓN DE DATOS (SNAPSHOT INMUTABLE)
+# ---------------------------------------------------
+# Las paradas y todos los índices derivados viven en un solo Dataset que no se
+# modifica después de construirse. Recargar el archivo construye uno nuevo en
+# segundo plano y lo reemplaza con una sola asignación (ver koox.store), así
+# que una consulta nunca ve mapas a medio construir ni mezcla dos versiones.
+Dataset = namedtuple("Dataset", [
+    "version",
+    "loaded_at",
+    "stops",
+    "columns",
+    "stops_by_id",
+    "route_to_stops",
+    "stop_to_routes",
+    "kdtree",
+    "engine",
+    "search",
+    "responses",
+])
+
+
+def build_dataset(stops, version):
+    stops_by_id, route_to_stops, stop_to_routes = build_maps(stops)
+    columns = build_columns(stops)
+    return Dataset(
+        version=version,
+        loaded_at=datetime.now().isoformat(timespec="seconds"),
+        stops=stops,
+        columns=columns,
+        stops_by_id=stops_by_id,
+        route_to_stops=route_to_stops,
+        stop_to_routes=stop_to_routes,
+        kdtree=build_kdtree(columns),
+        engine=build_routing_engine(columns),
+        search=build_search_index(stops, route_to_stops),
+        responses=build_prepared_responses(stops),
+    )
@@ -0,0 +1,209 @@
+import heapq
+import math
+import time
+from array import array
+from collections import namedtuple
+
+from koox.metrics import nearest_stop_duration
+
+
+# ---------------------------------------------------
+#   FUNCIÓN DISTANCIA
+# ---------------------------------------------------
+def calculate_distance(lat1, lon1, lat2, lon2):
+    R = 6371
+    dlat = math.radians(lat2 - lat1)
+    dlon = math.radians(lon2 - lon1)
+    a = math.sin(dlat/2)**2 + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dlon/2)**2
+    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+    return R * c
+
+
+# ---------------------------------------------------
+#   PARADAS EN COLUMNAS
+# ---------------------------------------------------
+# Para los cálculos se usan arreglos contiguos (módulo array) en lugar de los
+# diccionarios de cada parada: latitud/longitud ya convertidas a radianes, el
+# coseno de la latitud precalculado y las rutas de cada parada como enteros
+# (route_members[route_offsets[i]:route_offsets[i + 1]] son los índices en
+# route_names de las rutas de la parada i; el motor de rutas usa esos mismos
+# enteros). Los diccionarios sólo se usan para armar las respuestas JSON.
+EARTH_RADIUS_KM = 6371
+
+StopColumns = namedtuple("StopColumns", [
+    "ids",
+    "lat",
+    "lon",
+    "cos_lat",
+    "route_names",
+    "route_offsets",
+    "route_members",
+    "index_of",
+])
+
+
+def build_columns(stops):
+    route_names = tuple(sorted({r for s in stops for r in s.get("routes", [])}))
+    route_index = {r: i for i, r in enumerate(route_names)}
+
+    ids = array("q")
+    lat = array("d")
+    lon = array("d")
+    cos_lat = array("d")
+    route_offsets = array("l", [0])
+    route_members = array("l")
+
+    for s in stops:
+        lat_rad = math.radians(s["latitude"])
+        ids.append(s["id"])
+        lat.append(lat_rad)
+        lon.append(math.radians(s["longitude"]))
+        cos_lat.append(math.cos(lat_rad))
+        route_members.extend(sorted(route_index[r] for r in set(s.get("routes", []))))
+        route_offsets.append(len(route_members))
+
+    return StopColumns(
+        ids=ids,
+        lat=lat,
+        lon=lon,
+        cos_lat=cos_lat,
+        route_names=route_names,
+        route_offsets=route_offsets,
+        route_members=route_members,
+        index_of={stop_id: i for i, stop_id in enumerate(ids)},
+    )
+
+
+def distances_from(columns, lat1, lon1, cos1, indices):
+    # Haversine de un punto (en radianes) a muchas paradas a la vez. Devuelve
+    # un array("d") alineado con `indices`.
+    lat = columns.lat
+    lon = columns.lon
+    cos_lat = columns.cos_lat
+    sin = math.sin
+    sqrt = math.sqrt
+    atan2 = math.atan2
+    R = EARTH_RADIUS_KM
+
+    result = array("d")
+    for j in indices:
+        sdlat = sin((lat[j] - lat1) / 2)
+        sdlon = sin((lon[j] - lon1) / 2)
+        a = sdlat * sdlat + cos1 * cos_lat[j] * sdlon * sdlon
+        result.append(2 * R * atan2(sqrt(a), sqrt(1 - a)))
+    return result
+
+
+# ---------------------------------------------------
+#   ÍNDICE ESPACIAL (KD-TREE)
+# ---------------------------------------------------
+# Las paradas se proyectan a coordenadas cartesianas sobre la esfera unitaria.
+# La distancia euclidiana entre esos puntos (cuerda) crece igual que la
+# distancia Haversine, así que el árbol puede podar ramas sin errores de
+# proyección aunque la consulta esté lejos de Campeche.
+def to_unit_vector(latitude, longitude):
+    lat = math.radians(latitude)
+    lon = math.radians(longitude)
+    cos_lat = math.cos(lat)
+    return (cos_lat * math.cos(lon), cos_lat * math.sin(lon), math.sin(lat))
+
+
+def km_to_chord(distance_km):
+    angle = min(distance_km / EARTH_RADIUS_KM, math.pi)
+    return 2 * math.sin(angle / 2)
+
+
+# Paradas por hoja del árbol: cada hoja se evalúa con una sola llamada a
+# distances_from en lugar de una distancia por nodo.
+KDTREE_LEAF_SIZE = 16
+
+
+def build_kdtree(columns):
+    points = []
+    for i in range(len(columns.ids)):
+        cos_lat = columns.cos_lat[i]
+        lon = columns.lon[i]
+        point = (cos_lat * math.cos(lon), cos_lat * math.sin(lon), math.sin(columns.lat[i]))
+        points.append((point, i))
+
+    # Nodo interno: (eje, corte, izquierda, derecha); hoja: (None, índices)
+    def build(items, depth):
+        if len(items) <= KDTREE_LEAF_SIZE:
+            return (None, array("l", sorted(index for _, index in items)))
+        axis = depth % 3
+        items.sort(key=lambda item: item[0][axis])
+        mid = len(items) // 2
+        return (
+            axis,
+            items[mid][0][axis],
+            build(items[:mid], depth + 1),
+            build(items[mid:], depth + 1),
+        )
+
+    return build(points, 0) if points else None
+
+
+def nearest_stops(data, latitude, longitude, k=1, radius_km=None):
+    # Devuelve [(parada, distancia_km)] ordenado por distancia, desempatando
+    # por el orden original de las paradas.
+    stops = data.stops
+    columns = data.columns
+    if data.kdtree is None or (k is not None and k <= 0):
+        return []
+    # Sin coordenadas (o radio) finitos no hay parada más cercana
+    if not (math.isfinite(latitude) and math.isfinite(longitude)):
+        return []
+    if radius_km is not None and not math.isfinite(radius_km):
+        return []
+
+    target = to_unit_vector(latitude, longitude)
+    lat1 = math.radians(latitude)
+    lon1 = math.radians(longitude)
+    cos1 = math.cos(lat1)
+    max_chord = km_to_chord(radius_km) if radius_km is not None else float("inf")
+
+    # Max-heap (distancia negada) con los mejores k candidatos
+    best = []
+
+    def bound():
+        if k is not None and len(best) >= k:
+            return min(max_chord, km_to_chord(-best[0][0]) + 1e-9)
+        return max_chord
+
+    def search(node):
+        axis = node[0]
+        if axis is None:
+            indices = node[1]
+            for index, d in zip(indices, distances_from(columns, lat1, lon1, cos1, indices)):
+                if radius_km is not None and d > radius_km:
+                    continue
+                item = (-d, -index)
+                if k is None or len(best) < k:
+                    heapq.heappush(best, item)
+                elif item > best[0]:
+                    heapq.heapreplace(best, item)
+            return
+
+        _, split, left, right = node
+        diff = target[axis] - split
+        near, far = (left, right) if diff < 0 else (right, left)
+        search(near)
+        if abs(diff) <= bound():
+            search(far)
+
+    started = time.perf_counter()
+    search(data.kdtree)
+    nearest_stop_duration.observe(time.perf_counter() - started)
+
+    result = sorted((-d, -neg_index) for d, neg_index in best)
+    return [(stops[index], d) for d, index in result]
+
+
+# ---------------------------------------------------
+#   PARADA MÁS CERCANA
+# ---------------------------------------------------
+def closest_stop(data, latitude, longitude):
+    found = nearest_stops(data, latitude, longitude, k=1)
+    if not found:
+        return None, float("inf")
+    return found[0]
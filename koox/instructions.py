@@ -0,0 +1,207 @@
+import math
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from koox.cache import LRUCache
+from koox.config import BATCH_WORKERS, ROUTE_CACHE_SIZE, ROUTE_CACHE_TTL
+from koox.geo import closest_stop
+from koox.metrics import (
+    instructions_build_duration,
+    route_path_legs,
+    route_search_duration,
+    route_search_expanded,
+    route_search_rounds,
+    route_search_updates,
+    route_searches,
+)
+from koox.routing import build_instructions_from_states, find_route, find_routes_from
+
+
+# ---------------------------------------------------
+#   CACHÉ DE INSTRUCCIONES
+# ---------------------------------------------------
+# Muchas consultas distintas se ajustan al mismo par de paradas, así que se
+# guarda el resultado de find_route + build_instructions_from_states por
+# (versión de datos, parada_inicio, parada_destino).
+route_cache = LRUCache(ROUTE_CACHE_SIZE, ROUTE_CACHE_TTL)
+
+
+def route_instructions(data, start_id, end_id):
+    # Devuelve la lista de tramos o None si no hay ruta posible
+    found, instructions = route_cache.get((data.version, start_id, end_id))
+    if found:
+        return instructions
+    return compute_route_instructions(data, start_id, end_id)
+
+
+def compute_route_instructions(data, start_id, end_id):
+    # Busca la ruta sin consultar la caché y guarda el resultado en ella
+    stats = {}
+    started = time.perf_counter()
+    path_states = find_route(data, start_id, end_id, stats)
+    searched = time.perf_counter()
+    instructions = None if path_states is None else build_instructions_from_states(data, path_states)
+    built = time.perf_counter()
+
+    route_search_duration.observe(searched - started)
+    instructions_build_duration.observe(built - searched)
+    route_searches.inc("found" if instructions is not None else "not_found")
+    if stats:
+        route_search_rounds.observe(stats["rounds"])
+        route_search_expanded.observe(stats["expanded"])
+        route_search_updates.observe(stats["updates"])
+    if instructions is not None:
+        route_path_legs.observe(len(instructions))
+
+    route_cache.put((data.version, start_id, end_id), instructions)
+    return instructions
+
+
+# ---------------------------------------------------
+#   CONSULTA /instrucciones (FLASK Y ASGI)
+# ---------------------------------------------------
+# Las dos apps validan y arman la respuesta con estas funciones; sólo cambia
+# cómo buscan la ruta (ASGI la manda a su pool y junta consultas idénticas).
+def parse_route_query(data, inicio_str, destino_str):
+    # Devuelve (status, payload) con el error, o (None, (inicio, destino))
+    # con cada extremo como (parada, distancia_km)
+    if not inicio_str or not destino_str:
+        return 400, {"ok": False, "message": "Parámetros requeridos"}
+
+    try:
+        i_lat, i_lon = map(float, inicio_str.split(","))
+        d_lat, d_lon = map(float, destino_str.split(","))
+        if not all(math.isfinite(v) for v in (i_lat, i_lon, d_lat, d_lon)):
+            raise ValueError("Coordenadas inválidas")
+    except ValueError:
+        return 400, {"ok": False, "message": "Formato inválido"}
+
+    start = closest_stop(data, i_lat, i_lon)
+    end = closest_stop(data, d_lat, d_lon)
+    if not start[0] or not end[0]:
+        return 404, {"ok": False, "message": "No se encontraron paradas"}
+    return None, (start, end)
+
+
+def route_response(start, end, instructions):
+    # Devuelve (status, payload) para los tramos encontrados (o None)
+    if instructions is None:
+        return 404, {"ok": False, "message": "No hay ruta posible"}
+
+    (start_stop, dist_start), (end_stop, dist_end) = start, end
+    return 200, {
+        "ok": True,
+        "start_stop": start_stop,
+        "end_stop": end_stop,
+        "instructions": instructions,
+        "num_buses": len(instructions),
+        "start_distance_km": round(dist_start, 3),
+        "end_distance_km": round(dist_end, 3)
+    }
+
+
+# ---------------------------------------------------
+#   INSTRUCCIONES EN LOTE (MUCHOS A MUCHOS)
+# ---------------------------------------------------
+def resolve_point(data, point):
+    # Acepta un id de parada, [lat, lon] o {"stop_id"} / {"latitude", "longitude"}.
+    # Devuelve (parada, distancia_km) o lanza ValueError si no se puede resolver.
+    if isinstance(point, dict) and "stop_id" in point:
+        point = point["stop_id"]
+        if not isinstance(point, int) or isinstance(point, bool):
+            raise ValueError("Id de parada inválido")
+    if isinstance(point, int) and not isinstance(point, bool):
+        if point not in data.stops_by_id:
+            raise ValueError("Parada no encontrada")
+        return data.stops_by_id[point], 0.0
+
+    # Sólo listas [lat, lon]: un texto como "12" no se desempaca letra por letra
+    if isinstance(point, dict):
+        latitude, longitude = point["latitude"], point["longitude"]
+    elif isinstance(point, (list, tuple)) and len(point) == 2:
+        latitude, longitude = point
+    else:
+        raise ValueError("Formato inválido")
+    latitude, longitude = float(latitude), float(longitude)
+    if not (math.isfinite(latitude) and math.isfinite(longitude)):
+        raise ValueError("Coordenadas inválidas")
+    stop, distance = closest_stop(data, latitude, longitude)
+    if not stop:
+        raise ValueError("No se encontraron paradas")
+    return stop, distance
+
+
+# ---------------------------------------------------
+#   POOL DE PROCESOS PARA LOTES
+# ---------------------------------------------------
+# Un solo pool por proceso del servidor, creado la primera vez que se usa.
+# Cada worker recibe el dataset una vez al arrancar; si los datos se recargan
+# se crea un pool nuevo y el anterior termina los trabajos que tenga.
+# Los workers se crean con spawn: hacer fork desde un servidor con hilos
+# puede copiar locks tomados.
+worker_dataset = None
+batch_pool = None
+batch_pool_key = None
+batch_pool_lock = threading.Lock()
+
+
+def init_batch_worker(data):
+    global worker_dataset
+    worker_dataset = data
+
+
+def batch_worker(job):
+    start_id, end_ids = job
+    return start_id, find_routes_from(worker_dataset, start_id, end_ids)
+
+
+def get_batch_pool(data):
+    global batch_pool, batch_pool_key
+
+    key = (os.getpid(), data.version)
+    with batch_pool_lock:
+        if batch_pool_key != key:
+            if batch_pool is not None and batch_pool_key[0] == os.getpid():
+                batch_pool.shutdown(wait=False)
+            batch_pool = ProcessPoolExecutor(
+                max_workers=BATCH_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=init_batch_worker,
+                initargs=(data,),
+            )
+            batch_pool_key = key
+        return batch_pool
+
+
+def shutdown_batch_pool():
+    global batch_pool, batch_pool_key
+
+    with batch_pool_lock:
+        if batch_pool is not None and batch_pool_key[0] == os.getpid():
+            batch_pool.shutdown(wait=False)
+        batch_pool = None
+        batch_pool_key = None
+
+
+def batch_instructions(data, start_ids, end_ids):
+    # Un árbol de búsqueda por parada de origen (no uno por par). No usa la
+    # caché de instrucciones: un lote grande la vaciaría para las consultas
+    # interactivas de /instrucciones.
+    # Devuelve {(inicio, destino): tramos o None}.
+    unique_ends = list(dict.fromkeys(end_ids))
+    jobs = [(start_id, unique_ends) for start_id in dict.fromkeys(start_ids)]
+
+    if BATCH_WORKERS > 1 and len(jobs) > 1:
+        searched = get_batch_pool(data).map(batch_worker, jobs)
+    else:
+        searched = ((start_id, find_routes_from(data, start_id, ends)) for start_id, ends in jobs)
+
+    results = {}
+    for start_id, paths in searched:
+        for end_id, path_states in paths.items():
+            instructions = None if path_states is None else build_instructions_from_states(data, path_states)
+            results[(start_id, end_id)] = instructions
+    return results
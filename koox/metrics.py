@@ -0,0 +1,156 @@
+import bisect
+import threading
+
+
+# ---------------------------------------------------
+#   MÉTRICAS (FORMATO PROMETHEUS)
+# ---------------------------------------------------
+# Contadores e histogramas en memoria, por proceso y seguros entre hilos.
+# GET /metrics los devuelve en el formato de texto de Prometheus.
+REGISTRY = []
+
+# Segundos: de 50 µs a 10 s
+LATENCY_BUCKETS = (
+    0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+    0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+# Conteos (paradas expandidas, etiquetas mejoradas, ...)
+COUNT_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 50000)
+
+# Camiones por viaje / rondas de búsqueda
+LEG_BUCKETS = (0, 1, 2, 3, 4, 5, 6, 8, 10)
+
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, int):
+        return str(value)
+    return repr(float(value))
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (
+        (name, str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n"))
+        for name, value in pairs
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+class Counter:
+    def __init__(self, name, description, labelnames=()):
+        self.name = name
+        self.description = description
+        self.labelnames = labelnames
+        self.values = {}
+        self.lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for labels, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{format_labels(self.labelnames, labels)} {format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, description, buckets=LATENCY_BUCKETS, labelnames=()):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(buckets)
+        self.labelnames = labelnames
+        # etiquetas -> [conteos por cubeta (+Inf al final), suma, total]
+        self.series = {}
+        self.lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(labels)
+            if series is None:
+                series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for labels, (counts, total, count) in sorted(self.series.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += bucket_count
+                    le = format_labels(self.labelnames, labels, [("le", format_value(bound))])
+                    lines.append(f"{self.name}_bucket{le} {cumulative}")
+                suffix = format_labels(self.labelnames, labels)
+                lines.append(f"{self.name}_sum{suffix} {format_value(total)}")
+                lines.append(f"{self.name}_count{suffix} {count}")
+        return lines
+
+
+def render_metrics(extra=()):
+    # extra: [(nombre, tipo, descripción, valor, {etiqueta: valor})] calculados
+    # al momento de la consulta (caché, versión de datos, ...)
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    for name, kind, description, value, labels in extra:
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {kind}")
+        lines.append(f"{name}{format_labels(labels.keys(), labels.values())} {format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+# ---------------------------------------------------
+#   MÉTRICAS DE LA API
+# ---------------------------------------------------
+http_requests = Counter(
+    "koox_http_requests_total", "Consultas atendidas por endpoint y status.",
+    labelnames=("endpoint", "method", "status"),
+)
+http_request_duration = Histogram(
+    "koox_http_request_duration_seconds", "Duración de cada consulta por endpoint.",
+    labelnames=("endpoint", "method"),
+)
+nearest_stop_duration = Histogram(
+    "koox_nearest_stop_seconds", "Duración de la búsqueda de paradas cercanas (KD-tree).",
+)
+route_searches = Counter(
+    "koox_route_searches_total", "Búsquedas de ruta (find_route) por resultado.",
+    labelnames=("result",),
+)
+route_search_duration = Histogram(
+    "koox_route_search_seconds", "Duración de find_route.",
+)
+route_search_rounds = Histogram(
+    "koox_route_search_rounds", "Rondas (camiones) exploradas por búsqueda.", buckets=LEG_BUCKETS,
+)
+route_search_expanded = Histogram(
+    "koox_route_search_stops_expanded", "Paradas expandidas por búsqueda.", buckets=COUNT_BUCKETS,
+)
+route_search_updates = Histogram(
+    "koox_route_search_label_updates", "Mejoras de distancia registradas por búsqueda.", buckets=COUNT_BUCKETS,
+)
+route_path_legs = Histogram(
+    "koox_route_path_legs", "Camiones del viaje encontrado.", buckets=LEG_BUCKETS,
+)
+instructions_build_duration = Histogram(
+    "koox_instructions_build_seconds", "Duración de armar los tramos (build_instructions_from_states).",
+)
+serialization_duration = Histogram(
+    "koox_serialization_seconds", "Duración de codificar respuestas JSON.",
+)
+serialization_bytes = Histogram(
+    "koox_serialization_bytes", "Tamaño de las respuestas JSON codificadas.",
+    buckets=(256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216),
+)
@@ -0,0 +1,72 @@
+import gzip
+import hashlib
+import json
+
+from werkzeug.http import parse_accept_header, parse_etags
+
+from koox.cache import LRUCache
+from koox.config import BUS_RESPONSE_CACHE_SIZE
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# ---------------------------------------------------
+#   RESPUESTAS PRECODIFICADAS (ETAG + GZIP/BROTLI)
+# ---------------------------------------------------
+# Los endpoints de sólo lectura de /paradas devuelven siempre los mismos
+# bytes, así que se codifican (y comprimen) una sola vez al cargar los datos.
+def encode_json(payload):
+    # Mismos bytes que jsonify (claves ordenadas, ASCII, sin espacios)
+    return (json.dumps(payload, ensure_ascii=True, sort_keys=True, separators=(",", ":")) + "\n").encode("utf-8")
+
+
+def prepare_response(payload):
+    body = encode_json(payload)
+    digest = hashlib.sha256(body).hexdigest()[:32]
+
+    variants = {"identity": (body, digest)}
+    variants["gzip"] = (gzip.compress(body, compresslevel=9, mtime=0), digest + "-gz")
+    if brotli is not None:
+        variants["br"] = (brotli.compress(body), digest + "-br")
+    return variants
+
+
+def select_variant(variants, client_has, accepts):
+    # client_has(etag): el cliente ya tiene esa versión (If-None-Match, con
+    # comparación débil: W/"..." también cuenta, RFC 7232 §3.2)
+    # accepts(codificación): el cliente acepta esa codificación (Accept-Encoding)
+    # Devuelve (codificación, status)
+    for encoding, (_, etag) in variants.items():
+        if client_has(etag):
+            return encoding, 304
+    for candidate in ("br", "gzip"):
+        if candidate in variants and accepts(candidate):
+            return candidate, 200
+    return "identity", 200
+
+
+def negotiate_response(variants, if_none_match, accept_encoding):
+    # Recibe los encabezados If-None-Match y Accept-Encoding tal como llegan.
+    # Devuelve (status, cuerpo, encabezados) para cualquiera de las dos apps.
+    client_etags = parse_etags(if_none_match)
+    accepted = parse_accept_header(accept_encoding)
+    encoding, status = select_variant(variants, client_etags.contains_weak, lambda e: bool(accepted[e]))
+
+    body = variants[encoding][0] if status == 200 else b""
+    headers = [("ETag", f'"{variants[encoding][1]}"'), ("Vary", "Accept-Encoding")]
+    if status == 200 and encoding != "identity":
+        headers.append(("Content-Encoding", encoding))
+    return status, body, headers
+
+
+def build_prepared_responses(stops):
+    return {
+        "all": prepare_response({"ok": True, "body": stops}),
+        "by_id": {s["id"]: prepare_response({"ok": True, "body": s}) for s in stops},
+    }
+
+
+bus_responses = LRUCache(BUS_RESPONSE_CACHE_SIZE, 0)
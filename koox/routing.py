@@ -0,0 +1,375 @@
+from array import array
+from itertools import chain, repeat
+from operator import add
+
+from koox.geo import calculate_distance, distances_from
+
+
+# ---------------------------------------------------
+#   MOTOR DE RUTAS (PRECALCULADO)
+# ---------------------------------------------------
+# Costo de un viaje: distancia de cada tramo + BUS_CHANGE_PENALTY por cada
+# cambio de camión. Todo lo que no depende de la consulta se calcula una sola
+# vez al cargar los datos:
+#   - paradas de cada ruta y su posición dentro de ella
+#   - distancias entre todas las paradas de una misma ruta (tramos)
+#   - grafo de transbordos ruta -> rutas que comparten alguna parada
+# Dentro del motor las rutas son enteros; path_from_parents devuelve los
+# nombres.
+BUS_CHANGE_PENALTY = 100.0
+
+# find_routes_from: con menos de un destino por cada tantas paradas sale más
+# barato resolver cada par con find_route, que poda con el costo de su único
+# destino. Medido en los datos reales y a 10x: el cruce queda entre 25 y 45.
+STOPS_PER_TARGET = 40
+
+
+def build_routing_engine(columns):
+    # Las rutas se identifican con su índice en columns.route_names (enteros)
+    # y la pertenencia parada -> rutas sale de las columnas route_offsets /
+    # route_members. Las distancias de cada ruta se guardan como triángulo
+    # superior: la fila i tiene las distancias de la parada i a las siguientes,
+    # y la distancia (i, j) con i < j está en dist[row_start[i] + j].
+    ids = columns.ids
+    offsets = columns.route_offsets
+    members = columns.route_members
+    num_routes = len(columns.route_names)
+
+    stop_routes = {}
+    route_members_of = [[] for _ in range(num_routes)]
+    for i, stop_id in enumerate(ids):
+        routes = tuple(members[offsets[i]:offsets[i + 1]])
+        if not routes:
+            continue
+        stop_routes[stop_id] = routes
+        for r in routes:
+            route_members_of[r].append(stop_id)
+
+    route_stops = []
+    route_pos = []
+    route_dist = []
+    route_row_start = []
+    for r in range(num_routes):
+        route_ids = sorted(set(route_members_of[r]))
+        indices = [columns.index_of[stop_id] for stop_id in route_ids]
+        dist = array("d")
+        row_start = array("l")
+        for i, a in enumerate(indices):
+            row_start.append(len(dist) - i - 1)
+            dist.extend(distances_from(columns, columns.lat[a], columns.lon[a], columns.cos_lat[a], indices[i + 1:]))
+
+        route_stops.append(tuple(route_ids))
+        route_pos.append({stop_id: i for i, stop_id in enumerate(route_ids)})
+        route_dist.append(dist)
+        route_row_start.append(row_start)
+
+    transfers = [set() for _ in range(num_routes)]
+    for routes in stop_routes.values():
+        for r in routes:
+            transfers[r].update(routes)
+    transfer_graph = [tuple(sorted(others - {r})) for r, others in enumerate(transfers)]
+
+    max_leg_km = max((max(dist) for dist in route_dist if dist), default=0.0)
+
+    return {
+        "route_names": columns.route_names,
+        "route_stops": route_stops,
+        "route_pos": route_pos,
+        "route_dist": route_dist,
+        "route_row_start": route_row_start,
+        "stop_routes": stop_routes,
+        "transfer_graph": transfer_graph,
+        "max_leg_km": max_leg_km,
+    }
+
+
+def leg_row(dist, row_start, n, i):
+    # Distancias de la parada i de una ruta a todas las de la ruta (en orden):
+    # la columna i de las filas anteriores, 0 y el resto de la fila i. Se
+    # recorre con map/chain para no pagar un paso de Python por elemento.
+    start = row_start[i]
+    column = map(dist.__getitem__, map(add, row_start[:i], repeat(i)))
+    return chain(column, (0.0,), dist[start + i + 1:start + n])
+
+
+def leg_distance(dist, row_start, i, j):
+    if i == j:
+        return 0.0
+    if i > j:
+        i, j = j, i
+    return dist[row_start[i] + j]
+
+
+def legs_to_destination(engine, end_id):
+    # Cuántos camiones hacen falta como mínimo desde cada ruta para llegar a
+    # la parada destino.
+    return route_hops(engine, engine["stop_routes"].get(end_id, ()))
+
+
+def route_hops(engine, routes):
+    # BFS sobre el grafo de transbordos desde varias rutas (1 = la ruta misma).
+    # El grafo es simétrico: sirve tanto hacia un destino como desde un origen.
+    hops = {r: 1 for r in routes}
+    frontier = list(hops)
+    while frontier:
+        next_frontier = []
+        for r in frontier:
+            for other in engine["transfer_graph"][r]:
+                if other not in hops:
+                    hops[other] = hops[r] + 1
+                    next_frontier.append(other)
+        frontier = next_frontier
+    return hops
+
+
+def find_route(data, start_id, end_id, stats=None):
+    # Búsqueda por rondas (estilo RAPTOR): la ronda L encuentra los viajes de
+    # L camiones. Devuelve la lista de estados (parada, ruta) o None. Si se
+    # pasa stats (dict), se llena con rondas, paradas expandidas y mejoras.
+    if start_id == end_id:
+        return []
+
+    if start_id not in data.stop_to_routes or end_id not in data.stops_by_id:
+        return None
+
+    engine = data.engine
+    route_stops = engine["route_stops"]
+    route_pos = engine["route_pos"]
+    route_dist = engine["route_dist"]
+    route_row_start = engine["route_row_start"]
+    stop_routes = engine["stop_routes"]
+
+    hops = legs_to_destination(engine, end_id)
+    start_hops = [hops[r] for r in stop_routes[start_id] if r in hops]
+    if not start_hops:
+        return None
+
+    # Cota de camiones: un tramo nunca mide más que max_leg_km, así que un
+    # viaje con más camiones que max_legs ya no puede ser más barato que el
+    # de min_legs camiones (cada cambio cuesta BUS_CHANGE_PENALTY).
+    min_legs = min(start_hops)
+    max_legs = min_legs + int(min_legs * engine["max_leg_km"] / BUS_CHANGE_PENALTY)
+
+    # best[parada] = menor distancia conocida; parents[L][parada] = (anterior, ruta)
+    best = {start_id: 0.0}
+    parents = [{}]
+    labels = {start_id: 0.0}
+    best_cost = float("inf")
+    best_round = None
+    expanded = 0
+    updates = 0
+
+    legs = 0
+    while labels and legs < max_legs:
+        legs += 1
+        penalty = BUS_CHANGE_PENALTY * (legs - 1)
+        if penalty >= best_cost:
+            break
+        expanded += len(labels)
+
+        round_parents = {}
+        improved = {}
+        last_round = legs == max_legs
+
+        for stop_id in sorted(labels):
+            base = labels[stop_id]
+            for route in stop_routes[stop_id]:
+                needed = hops.get(route)
+                if needed is None or legs + needed - 1 > max_legs:
+                    continue
+                if penalty + BUS_CHANGE_PENALTY * (needed - 1) >= best_cost:
+                    continue
+
+                pos = route_pos[route]
+                dist = route_dist[route]
+                row_start = route_row_start[route]
+                i = pos[stop_id]
+
+                # En la última ronda sólo importa llegar al destino
+                if last_round:
+                    neighbors = ((leg_distance(dist, row_start, i, pos[end_id]), end_id),)
+                else:
+                    neighbors = zip(leg_row(dist, row_start, len(pos), i), route_stops[route])
+
+                for d, neighbor_id in neighbors:
+                    candidate = base + d
+                    if candidate < best.get(neighbor_id, float("inf")) and penalty + candidate < best_cost:
+                        best[neighbor_id] = candidate
+                        improved[neighbor_id] = candidate
+                        round_parents[neighbor_id] = (stop_id, route)
+                        updates += 1
+
+        parents.append(round_parents)
+        if end_id in improved:
+            best_cost = penalty + improved[end_id]
+            best_round = legs
+        labels = improved
+
+    if stats is not None:
+        stats.update(rounds=len(parents) - 1, expanded=expanded, updates=updates)
+
+    if best_round is None:
+        return None
+
+    return path_from_parents(parents, start_id, end_id, best_round, engine["route_names"])
+
+
+def path_from_parents(parents, start_id, end_id, best_round, route_names):
+    # Reconstruir tramos desde el destino hacia atrás
+    legs_path = []
+    stop_id = end_id
+    for level in range(best_round, 0, -1):
+        prev_id, route = parents[level][stop_id]
+        legs_path.append((prev_id, stop_id, route_names[route]))
+        stop_id = prev_id
+    legs_path.reverse()
+
+    path = [(start_id, legs_path[0][2])]
+    for _, to_id, route in legs_path:
+        path.append((to_id, route))
+    return path
+
+
+def find_routes_from(data, start_id, end_ids):
+    # Variante uno-a-muchos de find_route: un solo árbol de búsqueda desde
+    # start_id para todos los destinos. Devuelve {destino: estados o None}.
+    results = {end_id: None for end_id in end_ids}
+    if start_id in results:
+        results[start_id] = []
+
+    targets = {end_id for end_id in results if end_id != start_id and end_id in data.stop_to_routes}
+    if start_id not in data.stop_to_routes or not targets:
+        return results
+
+    if len(targets) * STOPS_PER_TARGET < len(data.stops):
+        for end_id in targets:
+            results[end_id] = find_route(data, start_id, end_id)
+        return results
+
+    engine = data.engine
+    route_stops = engine["route_stops"]
+    route_dist = engine["route_dist"]
+    route_row_start = engine["route_row_start"]
+    route_pos = engine["route_pos"]
+    stop_routes = engine["stop_routes"]
+
+    # Mismas cotas que find_route, por destino: min_legs sale de un solo BFS
+    # desde las rutas del origen, y la búsqueda no pasa de la mayor max_legs.
+    from_start = route_hops(engine, stop_routes[start_id])
+    max_rounds = 0
+    for end_id in list(targets):
+        end_hops = [from_start[r] for r in stop_routes[end_id] if r in from_start]
+        if not end_hops:
+            targets.discard(end_id)
+            continue
+        min_legs = min(end_hops)
+        max_rounds = max(max_rounds, min_legs + int(min_legs * engine["max_leg_km"] / BUS_CHANGE_PENALTY))
+    if not targets:
+        return results
+
+    # Camiones que faltan desde cada ruta hasta el destino más cercano
+    hops = route_hops(engine, {r for end_id in targets for r in stop_routes[end_id]})
+
+    best = {start_id: 0.0}
+    parents = [{}]
+    labels = {start_id: 0.0}
+    target_cost = {end_id: float("inf") for end_id in targets}
+    target_round = {}
+    last_round_targets = {}
+
+    legs = 0
+    while labels and legs < max_rounds:
+        legs += 1
+        penalty = BUS_CHANGE_PENALTY * (legs - 1)
+        # Ninguna etiqueta de esta ronda puede mejorar al destino más caro
+        worst_cost = max(target_cost.values())
+        if penalty >= worst_cost:
+            break
+
+        round_parents = {}
+        improved = {}
+        last_round = legs == max_rounds
+
+        for stop_id in sorted(labels):
+            base = labels[stop_id]
+            for route in stop_routes[stop_id]:
+                needed = hops.get(route)
+                if needed is None or legs + needed - 1 > max_rounds:
+                    continue
+                if penalty + BUS_CHANGE_PENALTY * (needed - 1) >= worst_cost:
+                    continue
+
+                pos = route_pos[route]
+                dist = route_dist[route]
+                row_start = route_row_start[route]
+                i = pos[stop_id]
+
+                # En la última ronda sólo importa llegar a algún destino
+                if last_round:
+                    on_route = last_round_targets.get(route)
+                    if on_route is None:
+                        on_route = last_round_targets[route] = [t for t in targets if t in pos]
+                    neighbors = ((leg_distance(dist, row_start, i, pos[t]), t) for t in on_route)
+                else:
+                    neighbors = zip(leg_row(dist, row_start, len(pos), i), route_stops[route])
+
+                for d, neighbor_id in neighbors:
+                    candidate = base + d
+                    if candidate < best.get(neighbor_id, float("inf")) and penalty + candidate < worst_cost:
+                        best[neighbor_id] = candidate
+                        improved[neighbor_id] = candidate
+                        round_parents[neighbor_id] = (stop_id, route)
+
+        parents.append(round_parents)
+        for end_id in targets.intersection(improved):
+            cost = penalty + improved[end_id]
+            if cost < target_cost[end_id]:
+                target_cost[end_id] = cost
+                target_round[end_id] = legs
+        labels = improved
+
+    for end_id, best_round in target_round.items():
+        results[end_id] = path_from_parents(parents, start_id, end_id, best_round, engine["route_names"])
+    return results
+
+
+# ---------------------------------------------------
+#   INSTRUCCIONES (TRAMOS)
+# ---------------------------------------------------
+def build_instructions_from_states(data, path_states):
+    if not path_states:
+        return []
+
+    stops_by_id = data.stops_by_id
+    instructions = []
+    current_bus = path_states[0][1]
+    segment_start_stop_id = path_states[0][0]
+    last_stop_id = path_states[0][0]
+
+    for stop_id, bus in path_states[1:]:
+        if bus != current_bus:
+            instructions.append({
+                "from_stop": stops_by_id[segment_start_stop_id],
+                "to_stop": stops_by_id[last_stop_id],
+                "bus": current_bus
+            })
+            current_bus = bus
+            segment_start_stop_id = last_stop_id
+
+        last_stop_id = stop_id
+
+    instructions.append({
+        "from_stop": stops_by_id[segment_start_stop_id],
+        "to_stop": stops_by_id[last_stop_id],
+        "bus": current_bus
+    })
+
+    return instructions
+
+
+def instructions_distance(instructions):
+    total = 0.0
+    for leg in instructions:
+        a, b = leg["from_stop"], leg["to_stop"]
+        total += calculate_distance(a["latitude"], a["longitude"], b["latitude"], b["longitude"])
+    return total
@@ -0,0 +1,73 @@
+import unicodedata
+from collections import defaultdict
+
+
+# ---------------------------------------------------
+#   BÚSQUEDA DE PARADAS Y RUTAS (N-GRAMAS)
+# ---------------------------------------------------
+# Los nombres se normalizan (sin mayúsculas ni acentos: "Polvorín" ->
+# "polvorin") y se indexan todos sus fragmentos de 1 a 3 caracteres. Una
+# consulta corta se resuelve con una sola búsqueda en el diccionario; una
+# larga intersecta los trigramas y luego confirma la coincidencia.
+NGRAM_SIZE = 3
+
+
+def normalize_text(text):
+    decomposed = unicodedata.normalize("NFKD", text)
+    return "".join(c for c in decomposed if not unicodedata.combining(c)).casefold()
+
+
+def build_ngram_index(names):
+    # names: {clave: nombre}
+    normalized = {key: normalize_text(name) for key, name in names.items()}
+    grams = defaultdict(set)
+    for key, name in normalized.items():
+        for size in range(1, NGRAM_SIZE + 1):
+            for i in range(len(name) - size + 1):
+                grams[name[i:i + size]].add(key)
+    return {"names": normalized, "grams": dict(grams)}
+
+
+def search_ngram_index(index, query):
+    # Devuelve las claves cuyo nombre contiene la consulta, las que empiezan
+    # con ella primero, luego las que tienen una palabra que empieza con ella.
+    query = normalize_text(query.strip())
+    if not query:
+        return []
+
+    grams = index["grams"]
+    names = index["names"]
+    if len(query) <= NGRAM_SIZE:
+        matches = grams.get(query, set())
+    else:
+        postings = [grams.get(query[i:i + NGRAM_SIZE], set()) for i in range(len(query) - NGRAM_SIZE + 1)]
+        postings.sort(key=len)
+        matches = set(postings[0]).intersection(*postings[1:])
+        matches = {key for key in matches if query in names[key]}
+
+    def rank(key):
+        name = names[key]
+        if name.startswith(query):
+            return (0, name, key)
+        if (" " + query) in name:
+            return (1, name, key)
+        return (2, name, key)
+
+    return sorted(matches, key=rank)
+
+
+def build_search_index(stops, route_to_stops):
+    return {
+        "stops": build_ngram_index({s["id"]: s["stop_name"] for s in stops}),
+        "routes": build_ngram_index({r: r for r in route_to_stops}),
+        "stop_order": {s["id"]: i for i, s in enumerate(stops)},
+    }
+
+
+def stops_for_bus(data, name):
+    # Paradas de todas las rutas cuyo nombre contiene `name`, en el orden del archivo
+    stop_ids = set()
+    for route in search_ngram_index(data.search["routes"], name):
+        stop_ids.update(data.route_to_stops[route])
+    order = data.search["stop_order"]
+    return [data.stops_by_id[stop_id] for stop_id in sorted(stop_ids, key=order.get)]
@@ -0,0 +1,89 @@
+import logging
+import os
+import threading
+import time
+
+from koox.config import DATA_WATCH_INTERVAL, JSON_FILE
+from koox.dataset import build_dataset, load_data
+from koox.instructions import route_cache
+from koox.responses import bus_responses
+
+logger = logging.getLogger(__name__)
+
+# ---------------------------------------------------
+#   VERSIÓN VIGENTE
+# ---------------------------------------------------
+# Cada consulta toma el dataset vigente una sola vez (current_dataset) y lo
+# usa de principio a fin; reload_data lo reemplaza con una sola asignación.
+
+# Cargar datos iniciales
+try:
+    dataset = build_dataset(*load_data())
+except Exception as e:
+    print(f"Error al cargar los datos: {e}")
+    dataset = build_dataset([], "none")
+
+
+def current_dataset():
+    return dataset
+
+
+# ---------------------------------------------------
+#   RECARGA DE DATOS
+# ---------------------------------------------------
+reload_lock = threading.Lock()
+watcher_pid = None
+
+
+def reload_data():
+    # Devuelve (dataset, recargado). Si el contenido no cambió se conserva el
+    # dataset actual; si el archivo no se puede leer se lanza la excepción y
+    # se sigue sirviendo la versión anterior.
+    global dataset
+
+    with reload_lock:
+        stops, version = load_data()
+        if version == dataset.version:
+            return dataset, False
+
+        new_dataset = build_dataset(stops, version)
+        dataset = new_dataset
+        route_cache.clear()
+        bus_responses.clear()
+        return new_dataset, True
+
+
+def watch_data_file():
+    last_seen = None
+    while True:
+        time.sleep(DATA_WATCH_INTERVAL)
+        try:
+            st = os.stat(JSON_FILE)
+        except OSError:
+            continue
+
+        current = (st.st_mtime_ns, st.st_size)
+        if current == last_seen:
+            continue
+        last_seen = current
+
+        try:
+            new_dataset, reloaded = reload_data()
+            if reloaded:
+                logger.info("Datos recargados, versión %s", new_dataset.version)
+        except Exception as e:
+            logger.error("Error al recargar los datos: %s", e)
+
+
+def start_data_watcher():
+    # Un hilo por proceso (los workers de gunicorn se crean con fork y no
+    # heredan los hilos del proceso principal)
+    global watcher_pid
+
+    if DATA_WATCH_INTERVAL <= 0 or watcher_pid == os.getpid():
+        return
+    with reload_lock:
+        if watcher_pid == os.getpid():
+            return
+        watcher_pid = os.getpid()
+    threading.Thread(target=watch_data_file, name="koox-data-watcher", daemon=True).start()
@@ -1,195 +1,189 @@
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, Response, request, jsonify, render_template, g
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 from datetime import datetime
-import json
+import cProfile
+import hmac
+import io
 import math
-import heapq
-from collections import defaultdict
+import pstats
+import threading
+import time
+
+from koox.config import (
+    ADMIN_TOKEN,
+    BATCH_MAX_INSTRUCTION_PAIRS,
+    BATCH_MAX_PAIRS,
+    NEAREST_MAX_K,
+    PROFILE_TOP,
+    SEARCH_MAX_PER_PAGE,
+    SEARCH_PER_PAGE,
+)
+from koox.geo import closest_stop, nearest_stops
+from koox.instructions import (
+    batch_instructions,
+    parse_route_query,
+    resolve_point,
+    route_cache,
+    route_instructions,
+    route_response,
+)
+from koox.metrics import (
+    http_request_duration,
+    http_requests,
+    render_metrics,
+    serialization_bytes,
+    serialization_duration,
+)
+from koox.responses import bus_responses, negotiate_response, prepare_response
+from koox.routing import instructions_distance
+from koox.search import normalize_text, search_ngram_index, stops_for_bus
+from koox.store import current_dataset, reload_data, start_data_watcher
+
+# jsonify con tiempo y tamaño de cada respuesta en /metrics
+class TimedJSONProvider(DefaultJSONProvider):
+    def dumps(self, obj, **kwargs):
+        started = time.perf_counter()
+        body = super().dumps(obj, **kwargs)
+        serialization_duration.observe(time.perf_counter() - started)
+        serialization_bytes.observe(len(body))
+        return body
 
-# Archivo JSON
-JSON_FILE = 'db/koox_stops_routes.json'
-
-# Función para cargar datos
-def load_data():
-    try:
-        with open(JSON_FILE, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        raise Exception(f"El archivo {JSON_FILE} no fue encontrado.")
-    except json.JSONDecodeError:
-        raise Exception(f"Error al decodificar el archivo JSON.")
-
-# Cargar datos iniciales
-try:
-    stops_data = load_data()
-except Exception as e:
-    print(f"Error al cargar los datos: {e}")
-    stops_data = []
 
 # Crear la app Flask
 app = Flask(__name__)
+app.json = TimedJSONProvider(app)
 CORS(app)  # <<<<<< ENABLE CORS PARA WEB Y FLUTTER WEB
 
-# ---------------------------------------------------
-#   FUNCIÓN DISTANCIA
-# ---------------------------------------------------
-def calculate_distance(lat1, lon1, lat2, lon2):
-    R = 6371
-    dlat = math.radians(lat2 - lat1)
-    dlon = math.radians(lon2 - lon1)
-    a = math.sin(dlat/2)**2 + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dlon/2)**2
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-    return R * c
-
-
-# ---------------------------------------------------
-#   MAPAS AUXILIARES
-# ---------------------------------------------------
-stops_by_id = {s["id"]: s for s in stops_data}
-
-route_to_stops = defaultdict(set)
-stop_to_routes = defaultdict(set)
 
-for stop in stops_data:
-    for r in stop.get("routes", []):
-        route_to_stops[r].add(stop["id"])
-        stop_to_routes[stop["id"]].add(r)
+def is_admin():
+    token = request.headers.get("Authorization", "")
+    if token.startswith("Bearer "):
+        token = token[len("Bearer "):]
+    token = token.strip()
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(token, ADMIN_TOKEN)
 
 
 # ---------------------------------------------------
-#   PARADA MÁS CERCANA
+#   RESPUESTAS PRECODIFICADAS
 # ---------------------------------------------------
-def closest_stop(latitude, longitude):
-    closest = None
-    min_distance = float("inf")
-
-    for stop in stops_data:
-        d = calculate_distance(latitude, longitude, stop['latitude'], stop['longitude'])
-        if d < min_distance:
-            min_distance = d
-            closest = stop
-
-    return closest, min_distance
+def send_prepared(variants):
+    status, body, headers = negotiate_response(
+        variants,
+        request.headers.get("If-None-Match", ""),
+        request.headers.get("Accept-Encoding", ""),
+    )
+    return Response(body, status=status, mimetype="application/json", headers=headers)
 
 
 # ---------------------------------------------------
-#   RECONSTRUIR PATH PARA A*
+#   PAGINACIÓN
 # ---------------------------------------------------
-def reconstruct_path(came_from, goal_state):
-    path = []
-    current = goal_state
-
-    while current in came_from:
-        path.append(current)
-        current = came_from[current]
-
-    path.append(current)
-    path.reverse()
-    return path
+def parse_pagination():
+    # Lanza ValueError si los parámetros no son válidos
+    page = int(request.args.get("page", 1))
+    per_page = int(request.args.get("per_page", SEARCH_PER_PAGE))
+    if page < 1 or per_page < 1 or per_page > SEARCH_MAX_PER_PAGE:
+        raise ValueError("Paginación inválida")
+    return page, per_page
+
+
+def paginate(items, page, per_page):
+    start = (page - 1) * per_page
+    return {
+        "ok": True,
+        "body": items[start:start + per_page],
+        "total": len(items),
+        "page": page,
+        "per_page": per_page
+    }
 
 
 # ---------------------------------------------------
-#   A* MINIMIZANDO CAMBIOS DE CAMIÓN
+#   VERSIÓN DE DATOS POR CONSULTA
 # ---------------------------------------------------
-def astar_route(start_id, end_id):
-
-    if start_id == end_id:
-        return []
-
-    if start_id not in stop_to_routes or end_id not in stops_by_id:
-        return None
-
-    BUS_CHANGE_PENALTY = 100.0
-    end_stop = stops_by_id[end_id]
+@app.before_request
+def use_current_dataset():
+    start_data_watcher()
+    g.dataset = current_dataset()
 
-    def heuristic(stop_id):
-        s = stops_by_id[stop_id]
-        return calculate_distance(
-            s["latitude"], s["longitude"],
-            end_stop["latitude"], end_stop["longitude"]
-        )
 
-    open_heap = []
-    g_score = {}
-    came_from = {}
-
-    start_routes = stop_to_routes.get(start_id, set())
-    if not start_routes:
-        return None
-
-    for route in start_routes:
-        state = (start_id, route)
-        g_score[state] = 0.0
-        heapq.heappush(open_heap, (heuristic(start_id), state))
-
-    while open_heap:
-        f, (current_id, current_bus) = heapq.heappop(open_heap)
-        current_state = (current_id, current_bus)
-
-        current_g = g_score.get(current_state, float("inf"))
-        if current_g + heuristic(current_id) < f - 1e-9:
-            continue
-
-        if current_id == end_id:
-            return reconstruct_path(came_from, current_state)
-
-        for route in stop_to_routes[current_id]:
-            for neighbor_id in route_to_stops[route]:
-                if neighbor_id == current_id:
-                    continue
-
-                neighbor_bus = route
-                neighbor_state = (neighbor_id, neighbor_bus)
-
-                step_dist = calculate_distance(
-                    stops_by_id[current_id]["latitude"],
-                    stops_by_id[current_id]["longitude"],
-                    stops_by_id[neighbor_id]["latitude"],
-                    stops_by_id[neighbor_id]["longitude"],
-                )
-
-                change_penalty = 0 if neighbor_bus == current_bus else BUS_CHANGE_PENALTY
-                tentative_g = current_g + step_dist + change_penalty
-
-                if tentative_g < g_score.get(neighbor_state, float("inf")):
-                    g_score[neighbor_state] = tentative_g
-                    came_from[neighbor_state] = current_state
-                    heapq.heappush(open_heap, (tentative_g + heuristic(neighbor_id), neighbor_state))
-
-    return None
+@app.after_request
+def add_dataset_version(response):
+    data = g.get("dataset")
+    if data is not None:
+        response.headers["X-Dataset-Version"] = data.version
+    return response
 
 
 # ---------------------------------------------------
-#   INSTRUCCIONES (TRAMOS)
+#   MÉTRICAS Y PERFILADO POR CONSULTA
 # ---------------------------------------------------
-def build_instructions_from_states(path_states):
-    if not path_states:
-        return []
-
-    instructions = []
-    current_bus = path_states[0][1]
-    segment_start_stop_id = path_states[0][0]
-    last_stop_id = path_states[0][0]
-
-    for stop_id, bus in path_states[1:]:
-        if bus != current_bus:
-            instructions.append({
-                "from_stop": stops_by_id[segment_start_stop_id],
-                "to_stop": stops_by_id[last_stop_id],
-                "bus": current_bus
-            })
-            current_bus = bus
-            segment_start_stop_id = last_stop_id
-
-        last_stop_id = stop_id
-
-    instructions.append({
-        "from_stop": stops_by_id[segment_start_stop_id],
-        "to_stop": stops_by_id[last_stop_id],
-        "bus": current_bus
-    })
-
-    return instructions
+# Las consultas perfiladas no cuentan en /metrics: cProfile las hace mucho
+# más lentas. Sólo se perfila una consulta a la vez: desde Python 3.12
+# cProfile usa sys.monitoring, que es de todo el proceso (un segundo perfil
+# falla con ValueError y el resumen incluye a los demás hilos).
+profile_lock = threading.Lock()
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+    if request.args.get("profile") == "1" or request.headers.get("X-Profile") == "1":
+        if not is_admin():
+            return jsonify({"ok": False, "message": "No autorizado"}), 403
+        if not profile_lock.acquire(blocking=False):
+            return jsonify({"ok": False, "message": "Ya hay una consulta perfilada en curso"}), 409
+        g.profiler = cProfile.Profile()
+        try:
+            g.profiler.enable()
+        except ValueError:
+            # Otra herramienta de perfilado ya está activa en el proceso
+            g.profiler = None
+            profile_lock.release()
+            return jsonify({"ok": False, "message": "Ya hay una consulta perfilada en curso"}), 409
+
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.get("request_started")
+    if started is None or g.get("profiler") is not None:
+        return response
+
+    endpoint = request.url_rule.rule if request.url_rule else "desconocido"
+    http_request_duration.observe(time.perf_counter() - started, endpoint, request.method)
+    http_requests.inc(endpoint, request.method, str(response.status_code))
+    return response
+
+
+@app.after_request
+def send_profile(response):
+    profiler = g.get("profiler")
+    if profiler is None:
+        return response
+    profiler.disable()
+    g.profile_done = True
+    profile_lock.release()
+    elapsed = time.perf_counter() - g.request_started
+
+    # Resumen de cProfile en lugar de la respuesta original
+    out = io.StringIO()
+    out.write(f"{request.method} {request.full_path} -> {response.status_code} en {elapsed * 1000:.2f} ms\n\n")
+    pstats.Stats(profiler, stream=out).strip_dirs().sort_stats("cumulative").print_stats(PROFILE_TOP)
+
+    profile = Response(out.getvalue(), mimetype="text/plain")
+    profile.headers["X-Profile-Status"] = str(response.status_code)
+    return profile
+
+
+@app.teardown_request
+def release_profiler(exc):
+    # Si la consulta falló antes de send_profile, igual se libera el perfil
+    profiler = g.get("profiler")
+    if profiler is not None and not g.get("profile_done"):
+        profiler.disable()
+        profile_lock.release()
 
 
 # ---------------------------------------------------
@@ -198,23 +192,47 @@ def build_instructions_from_states(path_states):
 
 @app.route("/paradas")
 def get_paradas():
-    return jsonify({"ok": True, "body": stops_data})
+    return send_prepared(g.dataset.responses["all"])
 
 
 @app.route("/paradas/<int:id>")
 def get_parada(id):
-    stop = next((s for s in stops_data if s["id"] == id), None)
-    if not stop:
+    prepared = g.dataset.responses["by_id"].get(id)
+    if not prepared:
         return jsonify({"ok": False, "message": "Parada no encontrada"}), 404
-    return jsonify({"ok": True, "body": stop})
+    return send_prepared(prepared)
 
 
 @app.route("/paradas/bus/<name>")
 def get_paradas_by_bus(name):
-    paradas = [s for s in stops_data if any(name.lower() in r.lower() for r in s["routes"])]
-    if not paradas:
+    data = g.dataset
+    key = (data.version, normalize_text(name))
+    found, prepared = bus_responses.get(key)
+    if not found:
+        paradas = stops_for_bus(data, name)
+        prepared = prepare_response({"ok": True, "body": paradas}) if paradas else None
+        bus_responses.put(key, prepared)
+
+    if not prepared:
         return jsonify({"ok": False, "message": "No se encontraron paradas para este bus"}), 404
-    return jsonify({"ok": True, "body": paradas})
+    return send_prepared(prepared)
+
+
+@app.route("/paradas/buscar")
+def buscar_paradas():
+    q = request.args.get("q", "")
+    if not q.strip():
+        return jsonify({"ok": False, "message": "Parámetros requeridos"}), 400
+
+    try:
+        page, per_page = parse_pagination()
+    except ValueError:
+        return jsonify({"ok": False, "message": "Parámetros inválidos"}), 400
+
+    data = g.dataset
+    stop_ids = search_ngram_index(data.search["stops"], q)
+    paradas = [data.stops_by_id[stop_id] for stop_id in stop_ids]
+    return jsonify(paginate(paradas, page, per_page))
 
 
 @app.route("/paradas/cercana")
@@ -222,51 +240,185 @@ def get_parada_cercana():
     try:
         latitude = float(request.args.get("latitude"))
         longitude = float(request.args.get("longitude"))
+        if not (math.isfinite(latitude) and math.isfinite(longitude)):
+            raise ValueError("Coordenadas inválidas")
     except:
         return jsonify({"ok": False, "message": "Parámetros inválidos"}), 400
 
-    stop, distance = closest_stop(latitude, longitude)
+    stop, distance = closest_stop(g.dataset, latitude, longitude)
     if not stop:
         return jsonify({"ok": False, "message": "No se encontró parada"}), 404
 
     return jsonify({"ok": True, "body": stop, "distance_km": round(distance, 2)})
 
 
+@app.route("/paradas/cercanas")
+def get_paradas_cercanas():
+    try:
+        latitude = float(request.args.get("latitude"))
+        longitude = float(request.args.get("longitude"))
+        k = request.args.get("k")
+        k = int(k) if k is not None else None
+        radius_km = request.args.get("radius_km")
+        radius_km = float(radius_km) if radius_km is not None else None
+        if not (math.isfinite(latitude) and math.isfinite(longitude)):
+            raise ValueError("Coordenadas inválidas")
+        if radius_km is not None and not math.isfinite(radius_km):
+            raise ValueError("Radio inválido")
+    except:
+        return jsonify({"ok": False, "message": "Parámetros inválidos"}), 400
+
+    if k is None:
+        k = 5 if radius_km is None else NEAREST_MAX_K
+    if k <= 0 or k > NEAREST_MAX_K or (radius_km is not None and radius_km <= 0):
+        return jsonify({"ok": False, "message": "Parámetros inválidos"}), 400
+
+    found = nearest_stops(g.dataset, latitude, longitude, k=k, radius_km=radius_km)
+    if not found:
+        return jsonify({"ok": False, "message": "No se encontraron paradas"}), 404
+
+    paradas = [dict(stop, distance_km=round(d, 3)) for stop, d in found]
+    return jsonify({"ok": True, "body": paradas, "total": len(paradas)})
+
+
+@app.route("/rutas")
+def get_rutas():
+    q = request.args.get("q", "")
+
+    try:
+        page, per_page = parse_pagination()
+    except ValueError:
+        return jsonify({"ok": False, "message": "Parámetros inválidos"}), 400
+
+    data = g.dataset
+    if q.strip():
+        names = search_ngram_index(data.search["routes"], q)
+    else:
+        names = sorted(data.route_to_stops, key=data.search["routes"]["names"].get)
+
+    rutas = [{"name": r, "num_stops": len(data.route_to_stops[r])} for r in names]
+    return jsonify(paginate(rutas, page, per_page))
+
+
 @app.route("/instrucciones")
 def instrucciones():
-    inicio_str = request.args.get("inicio")
-    destino_str = request.args.get("destino")
+    data = g.dataset
+    status, result = parse_route_query(data, request.args.get("inicio"), request.args.get("destino"))
+    if status is not None:
+        return jsonify(result), status
 
-    if not inicio_str or not destino_str:
-        return jsonify({"ok": False, "message": "Parámetros requeridos"}), 400
+    start, end = result
+    instructions = route_instructions(data, start[0]["id"], end[0]["id"])
+    status, payload = route_response(start, end, instructions)
+    return jsonify(payload), status
 
-    try:
-        i_lat, i_lon = map(float, inicio_str.split(","))
-        d_lat, d_lon = map(float, destino_str.split(","))
-    except:
-        return jsonify({"ok": False, "message": "Formato inválido"}), 400
 
-    start_stop, dist_start = closest_stop(i_lat, i_lon)
-    end_stop, dist_end = closest_stop(d_lat, d_lon)
+@app.route("/instrucciones/batch", methods=["POST"])
+def instrucciones_batch():
+    params = request.get_json(silent=True) or {}
+    origins = params.get("origins")
+    destinations = params.get("destinations")
+    output = params.get("format", "instructions")
 
-    if not start_stop or not end_stop:
-        return jsonify({"ok": False, "message": "No se encontraron paradas"}), 404
+    if not isinstance(origins, list) or not isinstance(destinations, list) or not origins or not destinations:
+        return jsonify({"ok": False, "message": "Parámetros requeridos"}), 400
+    if output not in ("instructions", "matrix"):
+        return jsonify({"ok": False, "message": "Formato inválido"}), 400
+    max_pairs = BATCH_MAX_PAIRS if output == "matrix" else BATCH_MAX_INSTRUCTION_PAIRS
+    if len(origins) * len(destinations) > max_pairs:
+        return jsonify({"ok": False, "message": f"Máximo {max_pairs} pares por consulta con format={output}"}), 400
 
-    path_states = astar_route(start_stop["id"], end_stop["id"])
+    try:
+        starts = [resolve_point(g.dataset, p) for p in origins]
+        ends = [resolve_point(g.dataset, p) for p in destinations]
+    except (ValueError, TypeError, KeyError):
+        return jsonify({"ok": False, "message": "Formato inválido"}), 400
 
-    if path_states is None:
-        return jsonify({"ok": False, "message": "No hay ruta posible"}), 404
+    results = batch_instructions(
+        g.dataset,
+        [stop["id"] for stop, _ in starts],
+        [stop["id"] for stop, _ in ends],
+    )
+
+    if output == "matrix":
+        num_buses = []
+        distance_km = []
+        for start_stop, _ in starts:
+            buses_row = []
+            distance_row = []
+            for end_stop, _ in ends:
+                instructions = results[(start_stop["id"], end_stop["id"])]
+                buses_row.append(None if instructions is None else len(instructions))
+                distance_row.append(None if instructions is None else round(instructions_distance(instructions), 3))
+            num_buses.append(buses_row)
+            distance_km.append(distance_row)
+
+        return jsonify({
+            "ok": True,
+            "origins": [{"stop_id": s["id"], "distance_km": round(d, 3)} for s, d in starts],
+            "destinations": [{"stop_id": s["id"], "distance_km": round(d, 3)} for s, d in ends],
+            "num_buses": num_buses,
+            "distance_km": distance_km
+        })
+
+    body = []
+    for i, (start_stop, dist_start) in enumerate(starts):
+        for j, (end_stop, dist_end) in enumerate(ends):
+            instructions = results[(start_stop["id"], end_stop["id"])]
+            item = {
+                "origin": i,
+                "destination": j,
+                "ok": instructions is not None,
+                "start_stop": start_stop,
+                "end_stop": end_stop,
+                "start_distance_km": round(dist_start, 3),
+                "end_distance_km": round(dist_end, 3)
+            }
+            if instructions is None:
+                item["message"] = "No hay ruta posible"
+            else:
+                item["instructions"] = instructions
+                item["num_buses"] = len(instructions)
+            body.append(item)
+
+    return jsonify({"ok": True, "body": body, "total": len(body)})
+
+
+@app.route("/instrucciones/cache")
+def instrucciones_cache():
+    return jsonify({"ok": True, "body": route_cache.stats()})
+
+
+@app.route("/metrics")
+def metrics():
+    data = g.dataset
+    cache = route_cache.stats()
+    extra = [
+        ("koox_dataset_info", "gauge", "Versión de datos vigente.", 1, {"version": data.version}),
+        ("koox_dataset_stops", "gauge", "Paradas cargadas.", len(data.stops), {}),
+        ("koox_route_cache_entries", "gauge", "Entradas en la caché de instrucciones.", cache["size"], {}),
+        ("koox_route_cache_hits_total", "counter", "Aciertos de la caché de instrucciones.", cache["hits"], {}),
+        ("koox_route_cache_misses_total", "counter", "Fallos de la caché de instrucciones.", cache["misses"], {}),
+    ]
+    return Response(render_metrics(extra), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.route("/admin/recargar", methods=["POST"])
+def admin_recargar():
+    if not is_admin():
+        return jsonify({"ok": False, "message": "No autorizado"}), 403
 
-    instructions = build_instructions_from_states(path_states)
+    try:
+        new_dataset, reloaded = reload_data()
+    except Exception as e:
+        return jsonify({"ok": False, "message": f"Error al recargar los datos: {e}"}), 500
 
     return jsonify({
         "ok": True,
-        "start_stop": start_stop,
-        "end_stop": end_stop,
-        "instructions": instructions,
-        "num_buses": len(instructions),
-        "start_distance_km": round(dist_start, 3),
-        "end_distance_km": round(dist_end, 3)
+        "reloaded": reloaded,
+        "version": new_dataset.version,
+        "loaded_at": new_dataset.loaded_at,
+        "total": len(new_dataset.stops)
     })
 
 
@@ -0,0 +1,151 @@
+import argparse
+import heapq
+import random
+import sys
+
+from koox import routing
+from koox.dataset import build_dataset, load_data
+from koox.geo import calculate_distance
+from koox.routing import find_route, find_routes_from
+
+# Compara find_route y find_routes_from contra una búsqueda de referencia
+# (Dijkstra simple, sin índices ni podas) con el mismo modelo de costo:
+# distancia de cada tramo + BUS_CHANGE_PENALTY por cada cambio de camión.
+#
+#   python verify_routing.py --origins 30 --pairs 1500
+#   python verify_routing.py --penalty 1
+#
+# Termina con código 1 si algún costo no coincide. Correrlo después de tocar
+# el motor de rutas (podas, cotas, estructuras precalculadas). Con los datos
+# reales y la penalización de 100 la cota de camiones (max_legs) casi nunca
+# descarta nada; una penalización chica (--penalty 1) sí la pone a prueba.
+
+TOLERANCE = 1e-6
+
+
+def stop_distance(data, a, b):
+    s, e = data.stops_by_id[a], data.stops_by_id[b]
+    return calculate_distance(s["latitude"], s["longitude"], e["latitude"], e["longitude"])
+
+
+def reference_costs(data, start_id):
+    # Dijkstra sobre paradas: un tramo va de cualquier parada a cualquier otra
+    # de una misma ruta y cuesta distancia + BUS_CHANGE_PENALTY. El costo del
+    # viaje es la suma menos una penalización (el primer camión no es cambio).
+    if start_id not in data.stop_to_routes:
+        return {start_id: 0.0}
+
+    dist = {start_id: 0.0}
+    heap = [(0.0, start_id)]
+    done = set()
+    while heap:
+        d, stop_id = heapq.heappop(heap)
+        if stop_id in done:
+            continue
+        done.add(stop_id)
+        for route in data.stop_to_routes[stop_id]:
+            for other in data.route_to_stops[route]:
+                if other in done:
+                    continue
+                candidate = d + stop_distance(data, stop_id, other) + routing.BUS_CHANGE_PENALTY
+                if candidate < dist.get(other, float("inf")):
+                    dist[other] = candidate
+                    heapq.heappush(heap, (candidate, other))
+
+    return {stop_id: max(0.0, d - routing.BUS_CHANGE_PENALTY) for stop_id, d in dist.items()}
+
+
+def path_cost(data, path_states):
+    # Costo de la lista de estados (parada, ruta); None si no es un viaje válido
+    if not path_states:
+        return 0.0
+
+    cost = 0.0
+    legs = 0
+    previous_route = None
+    for (prev_id, _), (stop_id, route) in zip(path_states, path_states[1:]):
+        if prev_id not in data.route_to_stops[route] or stop_id not in data.route_to_stops[route]:
+            return None
+        cost += stop_distance(data, prev_id, stop_id)
+        if route != previous_route:
+            legs += 1
+            previous_route = route
+    return cost + routing.BUS_CHANGE_PENALTY * (legs - 1)
+
+
+def check(label, data, start_id, end_id, path_states, expected):
+    if expected is None:
+        if path_states is not None:
+            return f"{label} {start_id}->{end_id}: encontró ruta, la referencia no"
+        return None
+    if path_states is None:
+        return f"{label} {start_id}->{end_id}: sin ruta, la referencia cuesta {expected:.6f}"
+
+    cost = path_cost(data, path_states)
+    if cost is None:
+        return f"{label} {start_id}->{end_id}: tramo fuera de su ruta"
+    if abs(cost - expected) > TOLERANCE:
+        return f"{label} {start_id}->{end_id}: costo {cost:.6f}, referencia {expected:.6f}"
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Verifica el motor de rutas contra una búsqueda de referencia")
+    parser.add_argument("--origins", type=int, default=30, help="orígenes aleatorios (uno a muchos contra todas las paradas)")
+    parser.add_argument("--pairs", type=int, default=1500, help="pares aleatorios para find_route")
+    parser.add_argument("--scale", type=int, default=1, help="factor de escala de datos sintéticos (ver benchmark.py)")
+    parser.add_argument("--penalty", type=float, help="usar otra penalización por cambio de camión")
+    parser.add_argument("--seed", type=int, default=42)
+    options = parser.parse_args()
+
+    if options.penalty is not None:
+        routing.BUS_CHANGE_PENALTY = options.penalty
+
+    stops, version = load_data()
+    if options.scale > 1:
+        from benchmark import scale_stops
+        stops = scale_stops(stops, options.scale, options.seed)
+    data = build_dataset(stops, version)
+
+    rng = random.Random(options.seed)
+    ids = [s["id"] for s in data.stops]
+    errors = []
+    checked = 0
+
+    # Pares agrupados por origen: una sola búsqueda de referencia por origen
+    by_origin = {}
+    for _ in range(options.pairs):
+        by_origin.setdefault(rng.choice(ids), []).append(rng.choice(ids))
+    full_origins = set(rng.sample(ids, min(options.origins, len(ids))))
+    for start_id in full_origins:
+        by_origin.setdefault(start_id, [])
+
+    for start_id, end_ids in by_origin.items():
+        expected = reference_costs(data, start_id)
+        for end_id in end_ids:
+            error = check("find_route", data, start_id, end_id, find_route(data, start_id, end_id), expected.get(end_id))
+            checked += 1
+            if error:
+                errors.append(error)
+
+        # Uno a muchos: con pocos destinos (los de los pares, se resuelven
+        # par por par) y, para los orígenes de --origins, con una muestra de
+        # paradas y con todas (un solo árbol de búsqueda)
+        sample = rng.sample(ids, max(1, len(ids) // 20)) if start_id in full_origins else ()
+        for targets in (end_ids, sample, ids if start_id in full_origins else ()):
+            if not targets:
+                continue
+            for end_id, path_states in find_routes_from(data, start_id, targets).items():
+                error = check("find_routes_from", data, start_id, end_id, path_states, expected.get(end_id))
+                checked += 1
+                if error:
+                    errors.append(error)
+
+    for error in errors[:20]:
+        print(error)
+    print(f"{checked} comparaciones, {len(errors)} diferencias")
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == "__main__":
+    main()